@@ -5,19 +5,47 @@ Retrieves emails from Gmail API and stores them locally for review.
 """
 
 import os
+import io
+import sys
+import asyncio
 import json
-import pickle
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+import base64
+import threading
+import functools
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 
+import httplib2
+from cachetools import LRUCache
 import requests
+from google_auth_httplib2 import AuthorizedHttp
 from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
 from dotenv import load_dotenv
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+try:
+    import aiohttp
+except ImportError:  # Optional: fall back to batch requests
+    aiohttp = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: token refreshes are not serialized across processes
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # Optional: fall back to the stdlib encoder
+    orjson = None
 
 # Load environment variables
 load_dotenv()
@@ -33,18 +61,159 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+HTTP_TIMEOUT = 60
+GMAIL_MESSAGES_URL = 'https://gmail.googleapis.com/gmail/v1/users/me/messages'
+MAX_CONCURRENT_FETCHES = 10
+LIST_PAGE_SIZE = 500
+LIST_QUEUE_SIZE = 200
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Date']
+_WANTED = frozenset(METADATA_HEADERS)
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+PARALLEL_EXTRACT_THRESHOLD = 32
+OUTPUT_BUFFER_SIZE = 1 << 20
+MESSAGE_CACHE_SIZE = 4096
+# Labels change (read, archived, ...), so cached messages re-read just these
+LABEL_PARAMS = {'format': 'minimal', 'fields': 'id,labelIds'}
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Retry only rate limiting and transient server errors."""
+    if isinstance(exc, HttpError):
+        return exc.resp.status in RETRYABLE_STATUSES
+    if aiohttp is not None and isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status in RETRYABLE_STATUSES
+    return False
+
+# Exponential backoff with jitter for 429/5xx; other errors fail immediately
+retry_transient = retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=wait_exponential_jitter(initial=1, max=32),
+    stop=stop_after_attempt(6),
+    reraise=True
+)
+
+@retry_transient
+async def _fetch_one(session: Any, msg_id: str, token: str, sem: asyncio.Semaphore,
+                     params: Dict[str, Any]) -> Dict[str, Any]:
+    """Fetch a single message from the Gmail REST API."""
+    # Expand list values (e.g. metadataHeaders) into repeated query parameters
+    query = [(key, item) for key, value in params.items()
+             for item in (value if isinstance(value, list) else [value])]
+    async with sem, session.get(
+        f"{GMAIL_MESSAGES_URL}/{msg_id}",
+        params=query,
+        headers={'Authorization': f'Bearer {token}'}
+    ) as response:
+        response.raise_for_status()
+        return await response.json()
+
+@functools.lru_cache(maxsize=4)
+def _build_filter(days_back: int, today_ordinal: int) -> str:
+    """Build the Gmail search query for emails after the given day."""
+    date_after = date.fromordinal(today_ordinal) - timedelta(days=days_back)
+    return f"after:{date_after.strftime('%Y/%m/%d')}"
+
+@dataclass
+class EmailInfo:
+    """Compact record of one retrieved email."""
+    __slots__ = ('id', 'threadId', 'subject', 'sender', 'recipient', 'date', 'body',
+                 'labels', 'snippet', 'internalDate', 'sizeEstimate', 'error')
+    
+    id: Optional[str]
+    threadId: Optional[str]
+    subject: str
+    sender: str
+    recipient: str
+    date: str
+    body: str
+    labels: List[str]
+    snippet: str
+    internalDate: Optional[str]
+    sizeEstimate: Optional[int]
+    error: Optional[str]
+    
+    @classmethod
+    def failed(cls, msg_id: str, error: str) -> 'EmailInfo':
+        """Placeholder record for an email whose details could not be extracted."""
+        return cls(msg_id, None, 'No Subject', 'Unknown', 'Unknown', 'Unknown', '', [], '', None, None, error)
+
+def extract_email_info(email_data: Dict[str, Any], include_body: bool = False) -> EmailInfo:
+    """Extract relevant information from Gmail API email data."""
+    try:
+        # Extract headers
+        headers = email_data.get('payload', {}).get('headers', [])
+        header_dict = {header['name']: header['value'] for header in headers if header['name'] in _WANTED}
+        
+        # Extract body content if requested
+        body = ""
+        if include_body:
+            body = extract_email_body(email_data.get('payload', {}))
+        
+        # Extract labels
+        labels = email_data.get('labelIds', [])
+        
+        # Create email info record
+        return EmailInfo(
+            id=email_data.get('id'),
+            threadId=email_data.get('threadId'),
+            subject=header_dict.get('Subject', 'No Subject'),
+            sender=header_dict.get('From', 'Unknown'),
+            recipient=header_dict.get('To', 'Unknown'),
+            date=header_dict.get('Date', 'Unknown'),
+            body=body,
+            labels=labels,
+            snippet=email_data.get('snippet', ''),
+            internalDate=email_data.get('internalDate'),
+            sizeEstimate=email_data.get('sizeEstimate'),
+            error=None
+        )
+        
+    except Exception as e:
+        logger.error(f"Error extracting email info: {str(e)}")
+        return EmailInfo.failed(email_data.get('id', 'unknown'), f"Failed to extract email info: {str(e)}")
+
+def extract_email_body(payload: Dict[str, Any]) -> str:
+    """Extract email body content from Gmail API payload."""
+    try:
+        # Handle multipart messages, walking nested parts depth-first in one pass
+        if 'parts' in payload:
+            parts_bytes = []
+            pending = list(reversed(payload['parts']))
+            while pending:
+                part = pending.pop()
+                if 'parts' in part:
+                    pending.extend(reversed(part['parts']))
+                elif part.get('mimeType') == 'text/plain' and part.get('body', {}).get('data'):
+                    parts_bytes.append(base64.urlsafe_b64decode(part['body']['data']))
+            return b''.join(parts_bytes).decode('utf-8', errors='ignore')
+        
+        # Handle simple text messages
+        elif payload.get('mimeType') == 'text/plain':
+            body_data = payload.get('body', {}).get('data', '')
+            if body_data:
+                return base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
+        
+        return "Email body not available"
+        
+    except Exception as e:
+        logger.error(f"Error extracting email body: {str(e)}")
+        return "Error extracting email body"
+
 class GmailWorkflow:
     """Main Gmail API workflow for email retrieval and processing."""
     
+    # Live (creds, http, service) per token file, keyed by the file's mtime
+    _service_cache: Dict[Tuple[str, float], Tuple[Any, Any, Any]] = {}
+    
     def __init__(self):
         """Initialize the Gmail workflow."""
         self.credentials_file = os.getenv('CREDENTIALS_FILE', 'credentials.json')
-        self.token_file = os.getenv('TOKEN_FILE', 'token.pickle')
+        self.token_file = os.getenv('TOKEN_FILE', 'token.enc')
         self.scopes = [
             'https://www.googleapis.com/auth/gmail.readonly',
             'https://www.googleapis.com/auth/gmail.modify'
         ]
         self.service = None
+        self.http = None
         self.encryption_key_file = os.getenv('ENCRYPTION_KEY_FILE', 'encryption.key')
         
         # Email retrieval settings
@@ -52,6 +221,24 @@ class GmailWorkflow:
         self.max_results = int(os.getenv('MAX_RESULTS', '100'))
         self.output_file = os.getenv('OUTPUT_FILE', 'retrieved_emails.json')
         
+        # Bodies need format='full'; by default only metadata headers are fetched
+        self.include_body = os.getenv('INCLUDE_BODY', '0').lower() in ('1', 'true')
+        
+        # Gmail batch requests accept at most 100 calls each
+        self.batch_size = max(1, min(int(os.getenv('GMAIL_BATCH_SIZE', '100')), 100))
+        self._retrieved: List[Dict[str, Any]] = []
+        self._results_lock = threading.Lock()
+        
+        # Concurrent fetches, kept within Gmail's per-user quota
+        # At least one, or no consumer would drain the list queue and the run would hang
+        self.max_concurrency = max(1, int(os.getenv('GMAIL_MAX_CONCURRENCY', str(MAX_CONCURRENT_FETCHES))))
+        self.creds = None
+        
+        # Fetched messages keyed by (id, format), without their mutable labelIds
+        self._message_cache: LRUCache = LRUCache(maxsize=MESSAGE_CACHE_SIZE)
+        self._label_refresh: Dict[str, Dict[str, Any]] = {}
+        self._summary_thread: Optional[threading.Thread] = None
+        
         logger.info(f"Gmail Workflow initialized with {self.days_back} days back, max {self.max_results} results")
     
     def load_encryption_key(self) -> bytes:
@@ -63,34 +250,99 @@ class GmailWorkflow:
             logger.error(f"Encryption key file not found: {self.encryption_key_file}")
             raise
     
+    def ensure_encryption_key(self) -> None:
+        """Create the encryption key if it does not exist yet, so a new token can be saved."""
+        if os.path.exists(self.encryption_key_file):
+            return
+        
+        logger.warning(f"Encryption key file not found, generating {self.encryption_key_file}")
+        # The key protects the token, so keep it readable by the owner only
+        fd = os.open(self.encryption_key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as key_file:
+            key_file.write(Fernet.generate_key())
+    
+    def load_token(self) -> Credentials:
+        """Decrypt the stored token file into OAuth2 credentials."""
+        with open(self.token_file, 'rb') as token:
+            token_json = Fernet(self.load_encryption_key()).decrypt(token.read())
+        return Credentials.from_authorized_user_info(json.loads(token_json), self.scopes)
+    
+    def save_token(self, creds: Credentials) -> None:
+        """Encrypt credentials as JSON and write them to the token file."""
+        token_bytes = Fernet(self.load_encryption_key()).encrypt(creds.to_json().encode('utf-8'))
+        with open(self.token_file, 'wb') as token:
+            token.write(token_bytes)
+    
+    def _read_token(self) -> Optional[Credentials]:
+        """Load stored credentials, treating a missing or unreadable token as absent."""
+        if not os.path.exists(self.token_file):
+            return None
+        try:
+            return self.load_token()
+        except (InvalidToken, ValueError, OSError) as e:
+            # OSError covers a missing encryption key; the OAuth flow then creates a new one
+            logger.warning(f"Ignoring unreadable token file {self.token_file}: {str(e)}")
+            return None
+    
+    @contextlib.contextmanager
+    def _token_lock(self) -> Iterator[None]:
+        """Hold an exclusive lock so only one process refreshes the token at a time."""
+        if fcntl is None:
+            yield
+            return
+        
+        with open(self.token_file + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
     def authenticate(self) -> bool:
         """Authenticate with Gmail API using OAuth2."""
         try:
-            creds = None
+            # Reuse the service (and its open connection) built from this token file
+            cached = self._service_cache.get(self._service_cache_key())
+            if cached and cached[0].valid:
+                self.creds, self.http, self.service = cached
+                logger.info("Reusing cached Gmail service")
+                return True
             
             # Load existing token if available
-            if os.path.exists(self.token_file):
-                with open(self.token_file, 'rb') as token:
-                    creds = pickle.load(token)
+            creds = self._read_token()
             
             # If no valid credentials available, let user log in
             if not creds or not creds.valid:
-                if creds and creds.expired and creds.refresh_token:
-                    logger.info("Refreshing expired credentials...")
-                    creds.refresh(Request())
-                else:
-                    logger.info("Starting OAuth2 authentication flow...")
-                    flow = InstalledAppFlow.from_client_secrets_file(
-                        self.credentials_file, self.scopes)
-                    # Use a different port that's likely to be available
-                    creds = flow.run_local_server(port=8090, open_browser=True)
-                
-                # Save credentials for next run
-                with open(self.token_file, 'wb') as token:
-                    pickle.dump(creds, token)
+                with self._token_lock():
+                    # Another process may have refreshed the token while we waited
+                    creds = self._read_token() or creds
+                    
+                    if not creds or not creds.valid:
+                        if creds and creds.expired and creds.refresh_token:
+                            logger.info("Refreshing expired credentials...")
+                            creds.refresh(Request())
+                        else:
+                            # Fail (or create the key) before the user goes through the browser flow
+                            self.ensure_encryption_key()
+                            logger.info("Starting OAuth2 authentication flow...")
+                            flow = InstalledAppFlow.from_client_secrets_file(
+                                self.credentials_file, self.scopes)
+                            # Use a different port that's likely to be available
+                            creds = flow.run_local_server(port=8090, open_browser=True)
+                        
+                        # Save credentials for next run
+                        self.save_token(creds)
             
             # Build the Gmail service
-            self.service = build('gmail', 'v1', credentials=creds)
+            self.creds = creds
+            # Reuse one keep-alive connection for every API call in this run
+            self.http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+            self.service = build('gmail', 'v1', http=self.http)
+            
+            cache_key = self._service_cache_key()
+            if cache_key:
+                self._service_cache[cache_key] = (creds, self.http, self.service)
+            
             logger.info("Successfully authenticated with Gmail API")
             return True
             
@@ -98,19 +350,28 @@ class GmailWorkflow:
             logger.error(f"Authentication failed: {str(e)}")
             return False
     
+    def _refresh_token(self) -> None:
+        """Refresh the access token and store it for the next run."""
+        with self._token_lock():
+            self.creds.refresh(Request())
+            self.save_token(self.creds)
+    
+    def _service_cache_key(self) -> Optional[Tuple[str, float]]:
+        """Key the service cache on the token file and its last modification."""
+        try:
+            return (self.token_file, os.path.getmtime(self.token_file))
+        except OSError:
+            return None
+    
     def get_email_filter(self) -> str:
         """Create Gmail API filter for recent emails."""
-        # Calculate date for filter (emails from last N days)
-        date_after = datetime.now() - timedelta(days=self.days_back)
-        date_str = date_after.strftime('%Y/%m/%d')
-        
-        # Create filter query
-        filter_query = f"after:{date_str}"
+        # Emails from the last N days; the query only changes once per day
+        filter_query = _build_filter(self.days_back, date.today().toordinal())
         logger.info(f"Using filter: {filter_query}")
         
         return filter_query
     
-    def retrieve_emails(self) -> List[Dict[str, Any]]:
+    def retrieve_emails(self) -> List[EmailInfo]:
         """Retrieve emails from Gmail API."""
         if not self.service:
             logger.error("Gmail service not initialized. Please authenticate first.")
@@ -119,41 +380,28 @@ class GmailWorkflow:
         try:
             filter_query = self.get_email_filter()
             
-            # Get list of email IDs
-            logger.info("Retrieving email list...")
-            results = self.service.users().messages().list(
-                userId='me',
-                q=filter_query,
-                maxResults=self.max_results
-            ).execute()
-            
-            messages = results.get('messages', [])
-            logger.info(f"Found {len(messages)} emails to retrieve")
-            
-            if not messages:
-                logger.warning("No emails found matching the criteria")
-                return []
-            
-            # Retrieve full email details
-            emails = []
-            for i, message in enumerate(messages):
-                logger.info(f"Retrieving email {i+1}/{len(messages)}: {message['id']}")
+            # List and fetch concurrently, or list then batch-fetch without aiohttp
+            if aiohttp is not None:
+                email_datas = asyncio.run(self._retrieve_async(filter_query))
+            else:
+                # Get list of email IDs
+                logger.info("Retrieving email list...")
+                results = self.service.users().messages().list(
+                    userId='me',
+                    q=filter_query,
+                    maxResults=self.max_results
+                ).execute()
                 
-                try:
-                    email_data = self.service.users().messages().get(
-                        userId='me',
-                        id=message['id'],
-                        format='full'
-                    ).execute()
-                    
-                    # Extract relevant email information
-                    email_info = self.extract_email_info(email_data)
-                    emails.append(email_info)
-                    
-                except HttpError as e:
-                    logger.error(f"Error retrieving email {message['id']}: {str(e)}")
-                    continue
+                messages = results.get('messages', [])
+                logger.info(f"Found {len(messages)} emails to retrieve")
+                
+                if not messages:
+                    logger.warning("No emails found matching the criteria")
+                    return []
+                
+                email_datas = self._retrieve_batched(messages)
             
+            emails = self._extract_all(email_datas)
             logger.info(f"Successfully retrieved {len(emails)} emails")
             return emails
             
@@ -164,71 +412,204 @@ class GmailWorkflow:
             logger.error(f"Unexpected error during email retrieval: {str(e)}")
             return []
     
-    def extract_email_info(self, email_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Extract relevant information from Gmail API email data."""
-        try:
-            # Extract headers
-            headers = email_data.get('payload', {}).get('headers', [])
-            header_dict = {header['name']: header['value'] for header in headers}
-            
-            # Extract body content
-            body = self.extract_email_body(email_data.get('payload', {}))
-            
-            # Extract labels
-            labels = email_data.get('labelIds', [])
-            
-            # Create email info dictionary
-            email_info = {
-                'id': email_data.get('id'),
-                'threadId': email_data.get('threadId'),
-                'subject': header_dict.get('Subject', 'No Subject'),
-                'sender': header_dict.get('From', 'Unknown'),
-                'recipient': header_dict.get('To', 'Unknown'),
-                'date': header_dict.get('Date', 'Unknown'),
-                'body': body,
-                'labels': labels,
-                'snippet': email_data.get('snippet', ''),
-                'internalDate': email_data.get('internalDate'),
-                'sizeEstimate': email_data.get('sizeEstimate')
-            }
-            
-            return email_info
-            
-        except Exception as e:
-            logger.error(f"Error extracting email info: {str(e)}")
-            return {
-                'id': email_data.get('id', 'unknown'),
-                'error': f"Failed to extract email info: {str(e)}"
-            }
+    def _extract_all(self, email_datas: List[Dict[str, Any]]) -> List[EmailInfo]:
+        """Extract email info, decoding bodies across worker processes when included."""
+        extract = functools.partial(extract_email_info, include_body=self.include_body)
+        
+        # Base64/UTF-8 body decoding is CPU-bound; metadata alone is not worth the pool
+        if self.include_body and len(email_datas) >= PARALLEL_EXTRACT_THRESHOLD:
+            with ProcessPoolExecutor() as executor:
+                return list(executor.map(extract, email_datas, chunksize=16))
+        return [extract(email_data) for email_data in email_datas]
     
-    def extract_email_body(self, payload: Dict[str, Any]) -> str:
-        """Extract email body content from Gmail API payload."""
-        try:
-            # Handle multipart messages
-            if 'parts' in payload:
-                body = ""
-                for part in payload['parts']:
-                    if part.get('mimeType') == 'text/plain':
-                        body_data = part.get('body', {}).get('data', '')
-                        if body_data:
-                            import base64
-                            body += base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
-                return body
-            
-            # Handle simple text messages
-            elif payload.get('mimeType') == 'text/plain':
-                body_data = payload.get('body', {}).get('data', '')
-                if body_data:
-                    import base64
-                    return base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
+    def _get_params(self) -> Dict[str, Any]:
+        """Build messages.get() parameters for the configured detail level."""
+        if self.include_body:
+            return {'format': 'full'}
+        return {'format': 'metadata', 'metadataHeaders': METADATA_HEADERS}
+    
+    @retry_transient
+    def _get_message(self, msg_id: str, **params: Any) -> Dict[str, Any]:
+        """Fetch a single message, retrying rate-limit and transient errors."""
+        params = params or self._get_params()
+        cache_key = (msg_id, params['format'])
+        email_data = self._message_cache.get(cache_key)
+        if email_data is None:
+            email_data = self.service.users().messages().get(
+                userId='me',
+                id=msg_id,
+                **params
+            ).execute()
+            self._cache_message(cache_key, email_data)
+        return email_data
+    
+    @retry_transient
+    def _get_labels(self, msg_id: str) -> Dict[str, Any]:
+        """Fetch only the current labels of a message."""
+        return self.service.users().messages().get(userId='me', id=msg_id, **LABEL_PARAMS).execute()
+    
+    def _cache_message(self, cache_key: Tuple[str, str], email_data: Dict[str, Any]) -> None:
+        """Cache a fetched message without its labels, which can change between runs."""
+        self._message_cache[cache_key] = {k: v for k, v in email_data.items() if k != 'labelIds'}
+    
+    def fetch_email_body(self, msg_id: str) -> str:
+        """Lazily fetch and extract the body of a single message."""
+        email_data = self._get_message(msg_id, format='full')
+        return extract_email_body(email_data.get('payload', {}))
+    
+    async def _retrieve_async(self, filter_query: str) -> List[Dict[str, Any]]:
+        """List and fetch messages concurrently over one pooled aiohttp session."""
+        # The producer pages through messages.list() while consumers fetch the ids
+        # already queued, overlapping list and get round trips
+        queue: asyncio.Queue = asyncio.Queue(maxsize=LIST_QUEUE_SIZE)
+        sem = asyncio.Semaphore(self.max_concurrency)
+        refresh_lock = asyncio.Lock()
+        params = self._get_params()
+        results: Dict[int, Dict[str, Any]] = {}
+        
+        async def current_token(rejected: Optional[str] = None) -> str:
+            # Refresh at most once per expiry, however many fetches notice it at the same time
+            async with refresh_lock:
+                if not self.creds.valid or self.creds.token == rejected:
+                    logger.info("Refreshing access token...")
+                    await asyncio.get_running_loop().run_in_executor(None, self._refresh_token)
+                return self.creds.token
+        
+        async def authorized(call) -> Dict[str, Any]:
+            # Long runs outlive the access token: on a 401, refresh once and retry
+            token = await current_token()
+            try:
+                return await call(token)
+            except aiohttp.ClientResponseError as e:
+                if e.status != 401:
+                    raise
+                return await call(await current_token(rejected=token))
+        
+        async def list_page(session, list_params: Dict[str, Any], token: str) -> Dict[str, Any]:
+            async with session.get(
+                GMAIL_MESSAGES_URL,
+                params=list_params,
+                headers={'Authorization': f'Bearer {token}'}
+            ) as response:
+                response.raise_for_status()
+                return await response.json()
+        
+        async def producer(session) -> int:
+            listed = 0
+            page_token = None
+            try:
+                logger.info("Retrieving email list...")
+                while listed < self.max_results:
+                    list_params = {'q': filter_query, 'maxResults': min(LIST_PAGE_SIZE, self.max_results - listed)}
+                    if page_token:
+                        list_params['pageToken'] = page_token
+                    page = await authorized(lambda token: list_page(session, list_params, token))
+                    
+                    for message in page.get('messages', [])[:self.max_results - listed]:
+                        await queue.put((listed, message['id']))
+                        listed += 1
+                    
+                    page_token = page.get('nextPageToken')
+                    if not page_token:
+                        break
+                return listed
+            finally:
+                # One sentinel per consumer so every consumer exits
+                for _ in range(self.max_concurrency):
+                    await queue.put(None)
+        
+        async def consumer(session) -> None:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                index, msg_id = item
+                cache_key = (msg_id, params['format'])
+                cached = self._message_cache.get(cache_key)
+                try:
+                    if cached is None:
+                        email_data = await authorized(lambda token: _fetch_one(session, msg_id, token, sem, params))
+                        self._cache_message(cache_key, email_data)
+                    else:
+                        labels = await authorized(lambda token: _fetch_one(session, msg_id, token, sem, LABEL_PARAMS))
+                        email_data = {**cached, 'labelIds': labels.get('labelIds', [])}
+                except Exception as e:
+                    logger.error(f"Error retrieving email {msg_id}: {str(e)}")
+                    continue
+                results[index] = email_data
+        
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            listed, *_ = await asyncio.gather(
+                producer(session),
+                *[consumer(session) for _ in range(self.max_concurrency)]
+            )
+        
+        logger.info(f"Found {listed} emails to retrieve")
+        if not listed:
+            logger.warning("No emails found matching the criteria")
+        
+        # Keep the list order regardless of completion order
+        return [results[index] for index in sorted(results)]
+    
+    def _retrieve_batched(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Fetch message details, up to batch_size messages per HTTP request."""
+        # Previously fetched messages only need their current labels, not the full payload
+        fmt = self._get_params()['format']
+        self._label_refresh = {m['id']: self._message_cache[(m['id'], fmt)] for m in messages
+                               if (m['id'], fmt) in self._message_cache}
+        if self._label_refresh:
+            logger.info(f"Reusing {len(self._label_refresh)} cached emails, refreshing their labels only")
+        
+        self._retrieved = []
+        for start in range(0, len(messages), self.batch_size):
+            chunk = messages[start:start + self.batch_size]
+            logger.info(f"Retrieving emails {start+1}-{start+len(chunk)}/{len(messages)} in one batch")
             
-            return "Email body not available"
+            batch = self.service.new_batch_http_request(callback=self._on_message)
+            for message in chunk:
+                params = LABEL_PARAMS if message['id'] in self._label_refresh else self._get_params()
+                batch.add(
+                    self.service.users().messages().get(
+                        userId='me',
+                        id=message['id'],
+                        **params
+                    ),
+                    request_id=message['id']
+                )
+            batch.execute()
+        
+        email_datas = self._retrieved
+        self._retrieved = []
+        self._label_refresh = {}
+        return email_datas
+    
+    def _on_message(self, request_id: str, response: Dict[str, Any], exception: Optional[Exception]) -> None:
+        """Batch callback: collect one message, logging failures without aborting the batch."""
+        # Payloads are pinned when the batch is built, so LRU eviction cannot mix up response kinds
+        cached = self._label_refresh.get(request_id)
+        if exception is not None:
+            if not _is_retryable(exception):
+                logger.error(f"Error retrieving email {request_id}: {str(exception)}")
+                return
             
-        except Exception as e:
-            logger.error(f"Error extracting email body: {str(e)}")
-            return "Error extracting email body"
+            # Retry throttled or transient failures individually with backoff
+            try:
+                response = self._get_labels(request_id) if cached is not None else self._get_message(request_id)
+            except Exception as e:
+                logger.error(f"Error retrieving email {request_id}: {str(e)}")
+                return
+        
+        if cached is not None:
+            # A labels-only response for a message whose payload is cached
+            response = {**cached, 'labelIds': response.get('labelIds', [])}
+        else:
+            self._cache_message((request_id, self._get_params()['format']), response)
+        
+        with self._results_lock:
+            self._retrieved.append(response)
     
-    def save_emails(self, emails: List[Dict[str, Any]]) -> None:
+    def save_emails(self, emails: List[EmailInfo]) -> None:
         """Save retrieved emails to JSON file."""
         try:
             output_data = {
@@ -236,37 +617,50 @@ class GmailWorkflow:
                 'total_emails': len(emails),
                 'days_back': self.days_back,
                 'max_results': self.max_results,
+                'include_body': self.include_body,
                 'emails': emails
             }
             
-            with open(self.output_file, 'w', encoding='utf-8') as f:
-                json.dump(output_data, f, indent=2, ensure_ascii=False)
+            # Encode once, then write through a large buffer to keep write() calls few
+            if orjson is not None:
+                payload = orjson.dumps(output_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            else:
+                output_data['emails'] = [asdict(email) for email in emails]
+                payload = json.dumps(output_data, indent=2, ensure_ascii=False).encode('utf-8')
+            
+            with open(self.output_file, 'wb', buffering=OUTPUT_BUFFER_SIZE) as f:
+                f.write(payload)
             
             logger.info(f"Saved {len(emails)} emails to {self.output_file}")
             
         except Exception as e:
             logger.error(f"Error saving emails: {str(e)}")
     
-    def print_summary(self, emails: List[Dict[str, Any]]) -> None:
-        """Print a summary of retrieved emails."""
-        print("\n" + "="*60)
-        print("📧 GMAIL EMAIL RETRIEVAL SUMMARY")
-        print("="*60)
-        print(f"📊 Total emails retrieved: {len(emails)}")
-        print(f"📅 Date range: Last {self.days_back} days")
-        print(f"📁 Output file: {self.output_file}")
-        print(f"📝 Log file: logs/gmail_workflow.log")
+    def print_summary(self, emails: List[EmailInfo]) -> None:
+        """Print a summary of retrieved emails without blocking on stdout."""
+        buf = io.StringIO()
+        print("\n" + "="*60, file=buf)
+        print("📧 GMAIL EMAIL RETRIEVAL SUMMARY", file=buf)
+        print("="*60, file=buf)
+        print(f"📊 Total emails retrieved: {len(emails)}", file=buf)
+        print(f"📅 Date range: Last {self.days_back} days", file=buf)
+        print(f"📁 Output file: {self.output_file}", file=buf)
+        print(f"📝 Log file: logs/gmail_workflow.log", file=buf)
         
         if emails:
-            print("\n📋 EMAIL SAMPLES:")
+            print("\n📋 EMAIL SAMPLES:", file=buf)
             for i, email in enumerate(emails[:5]):  # Show first 5 emails
-                print(f"\n{i+1}. Subject: {email.get('subject', 'No Subject')}")
-                print(f"   From: {email.get('sender', 'Unknown')}")
-                print(f"   Date: {email.get('date', 'Unknown')}")
-                print(f"   Labels: {', '.join(email.get('labels', []))}")
-                print(f"   Snippet: {email.get('snippet', '')[:100]}...")
+                print(f"\n{i+1}. Subject: {email.subject}", file=buf)
+                print(f"   From: {email.sender}", file=buf)
+                print(f"   Date: {email.date}", file=buf)
+                print(f"   Labels: {', '.join(email.labels)}", file=buf)
+                print(f"   Snippet: {email.snippet[:100]}...", file=buf)
+        
+        print("\n" + "="*60, file=buf)
         
-        print("\n" + "="*60)
+        # Hand the whole summary to a background thread as a single write
+        self._summary_thread = threading.Thread(target=sys.stdout.write, args=(buf.getvalue(),), daemon=True)
+        self._summary_thread.start()
     
     def run(self) -> bool:
         """Run the complete Gmail workflow."""
@@ -293,6 +687,12 @@ class GmailWorkflow:
         except Exception as e:
             logger.error(f"Workflow failed: {str(e)}")
             return False
+        finally:
+            # Make sure the summary is fully written before returning
+            if self._summary_thread is not None:
+                self._summary_thread.join()
+                self._summary_thread = None
+                sys.stdout.flush()
 
 def main():
     """Main entry point for the Gmail workflow."""
@@ -5,19 +5,40 @@ Uses a different authentication approach to avoid redirect URI issues.
 """
 
 import os
+import sys
+import asyncio
 import json
-import pickle
 import logging
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
 
+import httplib2
 import requests
+from google_auth_httplib2 import AuthorizedHttp
+from requests.adapters import HTTPAdapter
 from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
 from googleapiclient.errors import HttpError
 from dotenv import load_dotenv
 
+try:
+    from gmail_config_manager import OAuthTokenCache
+except ImportError:  # Run from archived/ without the repo root on sys.path: no shared token cache
+    OAuthTokenCache = None
+
+try:
+    import aiohttp
+except ImportError:  # Optional: only needed when a batch request is rejected
+    aiohttp = None
+
+try:
+    import orjson
+except ImportError:  # Optional: fall back to the stdlib encoder
+    orjson = None
+
 # Load environment variables
 load_dotenv()
 
@@ -26,28 +47,68 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('logs/gmail_workflow.log'),
+        logging.FileHandler('logs/gmail_workflow.log', delay=True),
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger(__name__)
 
+# Gmail batch requests accept at most 100 calls each
+BATCH_SIZE = 100
+MAX_CONCURRENT_FETCHES = 10
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Date']
+WANTED_HEADERS = frozenset(METADATA_HEADERS)
+GMAIL_MESSAGES_URL = 'https://gmail.googleapis.com/gmail/v1/users/me/messages'
+DISCOVERY_FILE = os.path.join('config', 'gmail_discovery.json')
+HTTP_TIMEOUT = 60
+POOL_SIZE = 20
+# Servers only compress responses for clients whose UA advertises gzip
+USER_AGENT = 'gmail-workflow (gzip)'
+
+# Partial-response masks: only the fields extract_email_info() reads
+LIST_FIELDS = 'messages/id'
+MESSAGE_FIELDS = 'id,threadId,labelIds,snippet,payload/headers'
+METADATA_FIELDS = ',internalDate,sizeEstimate'
+
+async def _fetch_one(session: Any, msg_id: str, token: str, sem: asyncio.Semaphore, fields: str) -> Dict[str, Any]:
+    """Fetch one message's metadata from the Gmail REST API."""
+    params = [('format', 'metadata'), ('fields', fields)]
+    params += [('metadataHeaders', header) for header in METADATA_HEADERS]
+    async with sem, session.get(
+        f"{GMAIL_MESSAGES_URL}/{msg_id}",
+        params=params,
+        headers={'Authorization': f'Bearer {token}'}
+    ) as response:
+        response.raise_for_status()
+        logger.debug(f"Message {msg_id} Content-Encoding: {response.headers.get('Content-Encoding', 'identity')}")
+        return await response.json()
+
 class SimpleGmailWorkflow:
     """Simplified Gmail API workflow for email retrieval."""
     
     def __init__(self):
         """Initialize the Gmail workflow."""
         self.credentials_file = 'credentials.json'
-        self.token_file = 'token.pickle'
+        self.token_file = 'token.json'
         self.scopes = [
             'https://www.googleapis.com/auth/gmail.readonly'
         ]
         self.service = None
+        self.creds = None
+        self.http = None
+        self.session = self._pooled_session()
+        self.token_cache = OAuthTokenCache() if OAuthTokenCache is not None else None
         
         # Email retrieval settings
         self.days_back = 2  # Testing with only 2 days
         self.max_results = 20  # Reduced for testing
         self.output_file = 'retrieved_emails.json'
+        self.include_metadata = False  # Add internalDate/sizeEstimate to each email
+        self.message_fields = MESSAGE_FIELDS + (METADATA_FIELDS if self.include_metadata else '')
+        
+        # Gmail search query, fixed for the lifetime of this run
+        self._filter_query = f"after:{(datetime.now() - timedelta(days=self.days_back)).strftime('%Y/%m/%d')}"
+        self._retrieved: Dict[str, Dict[str, Any]] = {}
         
         logger.info(f"Simple Gmail Workflow initialized with {self.days_back} days back, max {self.max_results} results")
     
@@ -58,14 +119,12 @@ class SimpleGmailWorkflow:
             
             # Load existing token if available
             if os.path.exists(self.token_file):
-                with open(self.token_file, 'rb') as token:
-                    creds = pickle.load(token)
+                creds = Credentials.from_authorized_user_file(self.token_file, self.scopes)
             
             # If no valid credentials available, let user log in
             if not creds or not creds.valid:
                 if creds and creds.expired and creds.refresh_token:
-                    logger.info("Refreshing expired credentials...")
-                    creds.refresh(Request())
+                    self._refresh_credentials(creds)
                 else:
                     logger.info("Starting OAuth2 authentication flow...")
                     flow = InstalledAppFlow.from_client_secrets_file(
@@ -92,11 +151,13 @@ class SimpleGmailWorkflow:
                             creds = flow.credentials
                 
                 # Save credentials for next run
-                with open(self.token_file, 'wb') as token:
-                    pickle.dump(creds, token)
+                Path(self.token_file).write_text(creds.to_json())
             
             # Build the Gmail service
-            self.service = build('gmail', 'v1', credentials=creds)
+            self.creds = creds
+            # One keep-alive transport for every API call in this run
+            self.http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+            self.service = self._build_service()
             logger.info("Successfully authenticated with Gmail API")
             return True
             
@@ -104,13 +165,45 @@ class SimpleGmailWorkflow:
             logger.error(f"Authentication failed: {str(e)}")
             return False
     
+    @staticmethod
+    def _pooled_session() -> requests.Session:
+        """Create a requests session with a connection pool for token refreshes."""
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+        return session
+    
+    def _build_service(self) -> Any:
+        """Build the Gmail service without fetching the discovery document over HTTP."""
+        # A local copy of https://gmail.googleapis.com/$discovery/rest?version=v1 wins,
+        # otherwise use the document bundled with google-api-python-client
+        if os.path.exists(DISCOVERY_FILE):
+            with open(DISCOVERY_FILE, 'r', encoding='utf-8') as f:
+                return build_from_document(f.read(), http=self.http)
+        return build('gmail', 'v1', http=self.http, static_discovery=True, cache_discovery=False)
+    
+    def _refresh_credentials(self, creds: Any) -> None:
+        """Refresh expired credentials, reusing an access token another run already obtained."""
+        if self.token_cache is None:
+            logger.info("Refreshing expired credentials...")
+            creds.refresh(Request(self.session))
+            return
+        
+        cache_key = OAuthTokenCache.make_key(
+            creds.token_uri, creds.client_id, creds.client_secret or '', creds.scopes or self.scopes,
+            creds.refresh_token)
+        
+        def refresh() -> Tuple[str, Optional[datetime]]:
+            logger.info("Refreshing expired credentials...")
+            creds.refresh(Request(self.session))
+            return creds.token, creds.expiry
+        
+        # Check, refresh and store under one lock so concurrent runs refresh only once
+        creds.token, creds.expiry = self.token_cache.get_or_refresh(cache_key, refresh)
+    
     def get_email_filter(self) -> str:
         """Create Gmail API filter for recent emails."""
-        date_after = datetime.now() - timedelta(days=self.days_back)
-        date_str = date_after.strftime('%Y/%m/%d')
-        filter_query = f"after:{date_str}"
-        logger.info(f"Using filter: {filter_query}")
-        return filter_query
+        logger.info(f"Using filter: {self._filter_query}")
+        return self._filter_query
     
     def retrieve_emails(self) -> List[Dict[str, Any]]:
         """Retrieve emails from Gmail API."""
@@ -121,12 +214,13 @@ class SimpleGmailWorkflow:
         try:
             filter_query = self.get_email_filter()
             
-            # Get list of email IDs
+            # Get list of email IDs; maxResults keeps this to a single page
             logger.info("Retrieving email list...")
             results = self.service.users().messages().list(
                 userId='me',
                 q=filter_query,
-                maxResults=self.max_results
+                maxResults=self.max_results,
+                fields=LIST_FIELDS
             ).execute()
             
             messages = results.get('messages', [])
@@ -136,27 +230,20 @@ class SimpleGmailWorkflow:
                 logger.warning("No emails found matching the criteria")
                 return []
             
-            # Retrieve full email details
-            emails = []
-            for i, message in enumerate(messages):
-                logger.info(f"Retrieving email {i+1}/{len(messages)}: {message['id']}")
-                
-                try:
-                    email_data = self.service.users().messages().get(
-                        userId='me',
-                        id=message['id'],
-                        format='metadata',
-                        metadataHeaders=['Subject', 'From', 'To', 'Date']
-                    ).execute()
-                    
-                    # Extract relevant email information
-                    email_info = self.extract_email_info(email_data)
-                    emails.append(email_info)
-                    
-                except HttpError as e:
-                    logger.error(f"Error retrieving email {message['id']}: {str(e)}")
-                    continue
+            # Retrieve email metadata in batches, concurrently if a batch is rejected
+            self._retrieved = {}
+            try:
+                self._retrieve_batched(messages)
+            except HttpError as e:
+                if aiohttp is None:
+                    raise
+                missing = [m['id'] for m in messages if m['id'] not in self._retrieved]
+                logger.warning(f"Batch request failed ({str(e)}), fetching {len(missing)} emails concurrently")
+                asyncio.run(self._retrieve_async(missing))
             
+            # Keep the order returned by messages().list()
+            emails = [self._retrieved[m['id']] for m in messages if m['id'] in self._retrieved]
+            self._retrieved = {}
             logger.info(f"Successfully retrieved {len(emails)} emails")
             return emails
             
@@ -167,12 +254,102 @@ class SimpleGmailWorkflow:
             logger.error(f"Unexpected error during email retrieval: {str(e)}")
             return []
     
+    def _retrieve_batched(self, messages: List[Dict[str, Any]]) -> None:
+        """Fetch email metadata, up to BATCH_SIZE messages per HTTP request."""
+        for start in range(0, len(messages), BATCH_SIZE):
+            chunk = messages[start:start + BATCH_SIZE]
+            
+            batch = self.service.new_batch_http_request(callback=self._on_message)
+            for i, message in enumerate(chunk, start):
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Retrieving email %d/%d: %s", i + 1, len(messages), message['id'])
+                batch.add(
+                    self.service.users().messages().get(
+                        userId='me',
+                        id=message['id'],
+                        format='metadata',
+                        metadataHeaders=METADATA_HEADERS,
+                        fields=self.message_fields
+                    ),
+                    request_id=message['id']
+                )
+            batch.execute()
+            logger.info("Fetched batch of %d messages", len(chunk))
+    
+    async def retrieve_emails_async(self) -> List[Dict[str, Any]]:
+        """Retrieve emails without blocking the event loop, so accounts can be fetched together."""
+        if not self.service:
+            logger.error("Gmail service not initialized. Please authenticate first.")
+            return []
+        
+        if aiohttp is None:
+            # No async HTTP client: run the batched retrieval on a worker thread
+            return await asyncio.get_running_loop().run_in_executor(None, self.retrieve_emails)
+        
+        try:
+            filter_query = self.get_email_filter()
+            
+            async with aiohttp.ClientSession(headers={'User-Agent': USER_AGENT}) as session:
+                logger.info("Retrieving email list...")
+                async with session.get(
+                    GMAIL_MESSAGES_URL,
+                    params={'q': filter_query, 'maxResults': self.max_results, 'fields': LIST_FIELDS},
+                    headers={'Authorization': f'Bearer {self.creds.token}'}
+                ) as response:
+                    response.raise_for_status()
+                    messages = (await response.json()).get('messages', [])
+                logger.info(f"Found {len(messages)} emails to retrieve")
+                
+                if not messages:
+                    logger.warning("No emails found matching the criteria")
+                    return []
+                
+                self._retrieved = {}
+                await self._fetch_all(session, [m['id'] for m in messages])
+            
+            # Keep the order returned by messages.list
+            emails = [self._retrieved[m['id']] for m in messages if m['id'] in self._retrieved]
+            self._retrieved = {}
+            logger.info(f"Successfully retrieved {len(emails)} emails")
+            return emails
+            
+        except Exception as e:
+            logger.error(f"Unexpected error during email retrieval: {str(e)}")
+            return []
+    
+    async def _retrieve_async(self, msg_ids: List[str]) -> None:
+        """Fetch email metadata concurrently over one shared aiohttp session."""
+        async with aiohttp.ClientSession(headers={'User-Agent': USER_AGENT}) as session:
+            await self._fetch_all(session, msg_ids)
+    
+    async def _fetch_all(self, session: Any, msg_ids: List[str]) -> None:
+        """Fetch email metadata for msg_ids concurrently into self._retrieved."""
+        sem = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+        results = await asyncio.gather(
+            *[_fetch_one(session, msg_id, self.creds.token, sem, self.message_fields) for msg_id in msg_ids],
+            return_exceptions=True
+        )
+        
+        for msg_id, result in zip(msg_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error retrieving email {msg_id}: {str(result)}")
+                continue
+            self._retrieved[msg_id] = self.extract_email_info(result)
+    
+    def _on_message(self, request_id: str, response: Dict[str, Any], exception: Optional[Exception]) -> None:
+        """Batch callback: collect one message, logging failures without aborting the batch."""
+        if exception is not None:
+            logger.error(f"Error retrieving email {request_id}: {str(exception)}")
+            return
+        
+        self._retrieved[request_id] = self.extract_email_info(response)
+    
     def extract_email_info(self, email_data: Dict[str, Any]) -> Dict[str, Any]:
         """Extract relevant information from Gmail API email data."""
         try:
             # Extract headers
             headers = email_data.get('payload', {}).get('headers', [])
-            header_dict = {header['name']: header['value'] for header in headers}
+            header_dict = {header['name']: header['value'] for header in headers if header['name'] in WANTED_HEADERS}
             
             # Extract labels
             labels = email_data.get('labelIds', [])
@@ -186,11 +363,14 @@ class SimpleGmailWorkflow:
                 'recipient': header_dict.get('To', 'Unknown'),
                 'date': header_dict.get('Date', 'Unknown'),
                 'labels': labels,
-                'snippet': email_data.get('snippet', ''),
-                'internalDate': email_data.get('internalDate'),
-                'sizeEstimate': email_data.get('sizeEstimate')
+                'snippet': email_data.get('snippet', '')
             }
             
+            # internalDate/sizeEstimate are not used downstream unless asked for
+            if self.include_metadata:
+                email_info['internalDate'] = email_data.get('internalDate')
+                email_info['sizeEstimate'] = email_data.get('sizeEstimate')
+            
             return email_info
             
         except Exception as e:
@@ -211,8 +391,12 @@ class SimpleGmailWorkflow:
                 'emails': emails
             }
             
-            with open(self.output_file, 'w', encoding='utf-8') as f:
-                json.dump(output_data, f, indent=2, ensure_ascii=False)
+            if orjson is not None:
+                with open(self.output_file, 'wb') as f:
+                    f.write(orjson.dumps(output_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+            else:
+                with open(self.output_file, 'w', encoding='utf-8') as f:
+                    json.dump(output_data, f, indent=2, ensure_ascii=False)
             
             logger.info(f"Saved {len(emails)} emails to {self.output_file}")
             
@@ -221,24 +405,30 @@ class SimpleGmailWorkflow:
     
     def print_summary(self, emails: List[Dict[str, Any]]) -> None:
         """Print a summary of retrieved emails."""
-        print("\n" + "="*60)
-        print("📧 GMAIL EMAIL RETRIEVAL SUMMARY")
-        print("="*60)
-        print(f"📊 Total emails retrieved: {len(emails)}")
-        print(f"📅 Date range: Last {self.days_back} days")
-        print(f"📁 Output file: {self.output_file}")
-        print(f"📝 Log file: logs/gmail_workflow.log")
+        lines = [
+            "\n" + "="*60,
+            "📧 GMAIL EMAIL RETRIEVAL SUMMARY",
+            "="*60,
+            f"📊 Total emails retrieved: {len(emails)}",
+            f"📅 Date range: Last {self.days_back} days",
+            f"📁 Output file: {self.output_file}",
+            f"📝 Log file: logs/gmail_workflow.log",
+        ]
         
         if emails:
-            print("\n📋 EMAIL SAMPLES:")
+            lines.append("\n📋 EMAIL SAMPLES:")
             for i, email in enumerate(emails[:5]):  # Show first 5 emails
-                print(f"\n{i+1}. Subject: {email.get('subject', 'No Subject')}")
-                print(f"   From: {email.get('sender', 'Unknown')}")
-                print(f"   Date: {email.get('date', 'Unknown')}")
-                print(f"   Labels: {', '.join(email.get('labels', []))}")
-                print(f"   Snippet: {email.get('snippet', '')[:100]}...")
+                lines.append(
+                    f"\n{i+1}. Subject: {email.get('subject', 'No Subject')}\n"
+                    f"   From: {email.get('sender', 'Unknown')}\n"
+                    f"   Date: {email.get('date', 'Unknown')}\n"
+                    f"   Labels: {', '.join(email.get('labels', []))}\n"
+                    f"   Snippet: {email.get('snippet', '')[:100]}..."
+                )
         
-        print("\n" + "="*60)
+        lines.append("\n" + "="*60)
+        # One write instead of a print() (and flush) per line
+        sys.stdout.write("\n".join(lines) + "\n")
     
     def run(self) -> bool:
         """Run the complete Gmail workflow."""
@@ -266,6 +456,17 @@ class SimpleGmailWorkflow:
             logger.error(f"Workflow failed: {str(e)}")
             return False
 
+async def retrieve_emails_for_accounts(workflows: List[SimpleGmailWorkflow],
+                                       max_workers: int = 5) -> List[List[Dict[str, Any]]]:
+    """Retrieve emails for several authenticated workflows concurrently."""
+    sem = asyncio.Semaphore(max_workers)
+    
+    async def retrieve(workflow: SimpleGmailWorkflow) -> List[Dict[str, Any]]:
+        async with sem:
+            return await workflow.retrieve_emails_async()
+    
+    return await asyncio.gather(*[retrieve(workflow) for workflow in workflows])
+
 def main():
     """Main entry point for the Gmail workflow."""
     print("🚀 Starting Simple Gmail API Email Retrieval Workflow...")
@@ -4,12 +4,21 @@ Gmail Configuration Manager
 Handles Gmail API configuration including client ID and credentials
 """
 
+import hashlib
 import json
 import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import cached_property
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, Iterator, Optional, Tuple
 import logging
 
+try:
+    import fcntl
+except ImportError:  # Windows: cache access is not locked across processes
+    fcntl = None
+
 
 class GmailConfigManager:
     def __init__(self, config_dir: str = "config"):
@@ -17,12 +26,26 @@ class GmailConfigManager:
         self.config_file = self.config_dir / "gmail_config.json"
         self.credentials_template = self.config_dir / "credentials_template.json"
         self.logger = logging.getLogger(__name__)
+        self._config: Optional[Dict[str, Any]] = None
 
     def load_config(self) -> Dict[str, Any]:
-        """Load Gmail configuration from file"""
+        """Load Gmail configuration, reading the file only on first use"""
+        if self._config is None:
+            self._config = self._read_config()
+        return self._config
+
+    def reload(self) -> Dict[str, Any]:
+        """Drop the cached configuration and read it from disk again"""
+        self._config = None
+        for name in ("client_id", "scopes", "redirect_uris"):
+            self.__dict__.pop(name, None)
+        return self.load_config()
+
+    def _read_config(self) -> Dict[str, Any]:
+        """Read and parse the Gmail configuration file"""
         try:
-            with open(self.config_file, "r") as f:
-                config = json.load(f)
+            with open(self.config_file, "rb") as f:
+                config = json.loads(f.read())
             self.logger.info("Gmail configuration loaded successfully")
             return config
         except FileNotFoundError:
@@ -52,20 +75,32 @@ class GmailConfigManager:
             "defaults": {"days_back": 30, "max_results": 100, "rate_limit": 1000, "rate_limit_window": 3600},
         }
 
+    @cached_property
+    def client_id(self) -> str:
+        """Gmail client ID from the cached configuration"""
+        return self.load_config()["gmail_api"]["client_id"]
+
+    @cached_property
+    def scopes(self) -> Tuple[str, ...]:
+        """Gmail API scopes from the cached configuration, shared as an immutable tuple"""
+        return tuple(self.load_config()["gmail_api"]["scopes"])
+
+    @cached_property
+    def redirect_uris(self) -> Tuple[str, ...]:
+        """OAuth2 redirect URIs from the cached configuration, shared as an immutable tuple"""
+        return tuple(self.load_config()["gmail_api"]["redirect_uris"])
+
     def get_client_id(self) -> str:
         """Get the Gmail client ID"""
-        config = self.load_config()
-        return config["gmail_api"]["client_id"]
+        return self.client_id
 
-    def get_scopes(self) -> list:
+    def get_scopes(self) -> Tuple[str, ...]:
         """Get Gmail API scopes"""
-        config = self.load_config()
-        return config["gmail_api"]["scopes"]
+        return self.scopes
 
-    def get_redirect_uris(self) -> list:
+    def get_redirect_uris(self) -> Tuple[str, ...]:
         """Get OAuth2 redirect URIs"""
-        config = self.load_config()
-        return config["gmail_api"]["redirect_uris"]
+        return self.redirect_uris
 
     def create_credentials_template(self, client_secret: str = None) -> bool:
         """Create credentials.json template with the provided client ID"""
@@ -100,15 +135,19 @@ class GmailConfigManager:
             self.logger.error(f"Failed to create credentials template: {e}")
             return False
 
-    def validate_credentials(self, credentials_file: str = "credentials.json") -> bool:
+    def validate_credentials(
+        self, credentials_file: str = "credentials.json", credentials: Optional[Dict[str, Any]] = None
+    ) -> bool:
         """Validate that credentials.json exists and has the correct client ID"""
         try:
-            if not os.path.exists(credentials_file):
-                self.logger.warning(f"Credentials file not found: {credentials_file}")
-                return False
+            # Callers that already parsed the file pass it in to skip a second read
+            if credentials is None:
+                if not os.path.exists(credentials_file):
+                    self.logger.warning(f"Credentials file not found: {credentials_file}")
+                    return False
 
-            with open(credentials_file, "r") as f:
-                credentials = json.load(f)
+                with open(credentials_file, "rb") as f:
+                    credentials = json.loads(f.read())
 
             expected_client_id = self.get_client_id()
             actual_client_id = credentials.get("installed", {}).get("client_id")
@@ -176,6 +215,112 @@ class GmailConfigManager:
         print("\n" + "=" * 60)
 
 
+class OAuthTokenCache:
+    """File-backed cache of OAuth access tokens shared across processes"""
+
+    # Treat tokens as expired slightly early so they are never used mid-expiry
+    EXPIRY_MARGIN = timedelta(seconds=60)
+
+    def __init__(self, cache_file: str = "config/.token_cache.json"):
+        self.cache_file = Path(cache_file)
+        self.lock_file = self.cache_file.with_name(self.cache_file.name + ".lock")
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def make_key(token_uri: str, client_id: str, client_secret: str, scopes: list, refresh_token: str) -> str:
+        """Build the cache key for one user of one client and scope set"""
+        # The refresh token identifies the account, so users of one OAuth client never share an entry
+        material = "\0".join((token_uri, client_id, client_secret, ",".join(sorted(scopes)), refresh_token))
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold an exclusive lock on the cache file"""
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_file, "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self) -> Dict[str, Dict[str, str]]:
+        """Read all cache entries; a missing or corrupt file is an empty cache"""
+        try:
+            with open(self.cache_file, "rb") as f:
+                entries = json.loads(f.read())
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError as e:
+            self.logger.warning(f"Ignoring invalid token cache {self.cache_file}: {e}")
+            return {}
+        if not isinstance(entries, dict):
+            self.logger.warning(f"Ignoring invalid token cache {self.cache_file}: not a JSON object")
+            return {}
+        return entries
+
+    @staticmethod
+    def _expiry(entry: Any) -> Optional[datetime]:
+        """Parse an entry's expiry; a hand-edited or old-format entry has none"""
+        try:
+            return datetime.fromisoformat(entry["expiry"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _lookup(self, entries: Dict[str, Any], key: str) -> Optional[Tuple[str, datetime]]:
+        """Return the (access_token, expiry) stored under key if it is still usable"""
+        entry = entries.get(key)
+        expiry = self._expiry(entry)
+        if expiry is None or expiry - self.EXPIRY_MARGIN <= datetime.utcnow():
+            return None
+        token = entry.get("access_token")
+        return (token, expiry) if isinstance(token, str) else None
+
+    def _store(self, entries: Dict[str, Any], key: str, token: str, expiry: datetime) -> None:
+        """Write entries plus the new token, dropping expired and malformed entries; call under the lock"""
+        now = datetime.utcnow()
+        entries = {k: v for k, v in entries.items() if (self._expiry(v) or now) > now}
+        entries[key] = {"access_token": token, "expiry": expiry.isoformat()}
+
+        # Tokens are secrets: write owner-only, then swap in atomically
+        tmp_file = self.cache_file.with_name(self.cache_file.name + ".tmp")
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_file, self.cache_file)
+
+    def get(self, key: str) -> Optional[Tuple[str, datetime]]:
+        """Return a cached (access_token, expiry) that is still usable"""
+        with self._locked():
+            return self._lookup(self._read(), key)
+
+    def put(self, key: str, token: str, expiry: datetime) -> None:
+        """Store an access token until its (naive UTC) expiry"""
+        with self._locked():
+            self._store(self._read(), key, token, expiry)
+
+    def get_or_refresh(
+        self, key: str, refresh: Callable[[], Tuple[str, Optional[datetime]]]
+    ) -> Tuple[str, Optional[datetime]]:
+        """Return a usable cached token, or call refresh() and cache its (token, expiry), under one lock
+
+        Workers that miss together wait for the first refresh instead of each calling the token endpoint
+        """
+        with self._locked():
+            entries = self._read()
+            cached = self._lookup(entries, key)
+            if cached:
+                self.logger.info("Using cached access token")
+                return cached
+
+            token, expiry = refresh()
+            if expiry:
+                self._store(entries, key, token, expiry)
+            return token, expiry
+
+
 def main():
     """Main function to demonstrate configuration manager"""
     config_manager = GmailConfigManager()
@@ -6,21 +6,29 @@ Includes robust authentication, error handling, and complete email processing.
 """
 
 import os
+import io
 import json
+import random
+import time
+import asyncio
 import pickle
 import logging
 import base64
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+import functools
+import importlib.util
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
 
-import requests
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from cryptography.fernet import Fernet
+# The Google client libraries are imported where first used to keep startup fast
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # Optional: fall back to the stdlib encoder
+    orjson = None
+
 # Load environment variables
 load_dotenv()
 
@@ -35,14 +43,83 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Gmail accepts at most 100 calls per batch request; GMAIL_BATCH_SIZE may lower it
+BATCH_SIZE = 100
+# messages.list returns at most 500 ids per page
+LIST_PAGE_SIZE = 500
+GMAIL_MESSAGES_URL = 'https://gmail.googleapis.com/gmail/v1/users/me/messages'
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Date']
+# Header names vary in case between senders, so match them lowercased
+_WANTED_HEADERS = frozenset(header.lower() for header in METADATA_HEADERS)
+# Partial-response masks: only return the fields extract_email_info reads
+LIST_FIELDS = 'messages(id),nextPageToken'
+MESSAGE_FIELDS = 'id,threadId,labelIds,snippet,internalDate,sizeEstimate,payload/headers'
+BODY_FIELDS = ',payload/mimeType,payload/body,payload/parts'
+# Stays well inside Gmail's per-user quota of 250 units/sec (5 units per get)
+MAX_CONCURRENT_FETCHES = 10
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 5
+OUTPUT_BUFFER_SIZE = 1 << 20
+EMAIL_COLUMNS = ('id', 'threadId', 'subject', 'sender', 'recipient', 'date', 'labels',
+                 'snippet', 'internalDate', 'sizeEstimate', 'error')
+HTTP_TIMEOUT = 60
+LEGACY_TOKEN_FILE = 'token.pickle'
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter, capped at 60 seconds."""
+    return min(2 ** attempt, 60) * random.uniform(0.5, 1.5)
+
+def _execute_with_backoff(request: Any) -> Dict[str, Any]:
+    """Execute a googleapiclient request, retrying 429/5xx responses with backoff."""
+    from googleapiclient.errors import HttpError
+    
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return request.execute()
+        except HttpError as e:
+            if e.resp.status not in RETRYABLE_STATUSES or attempt == MAX_RETRIES:
+                raise
+            delay = _backoff_delay(attempt)
+            logger.warning(f"Gmail API returned {e.resp.status}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+async def _fetch_one(session: Any, sem: asyncio.Semaphore, msg_id: str, token: str,
+                     params: List[tuple]) -> Dict[str, Any]:
+    """Fetch one message from the Gmail REST API, backing off on 429/5xx."""
+    for attempt in range(MAX_RETRIES + 1):
+        async with sem, session.get(
+            f"{GMAIL_MESSAGES_URL}/{msg_id}",
+            params=params,
+            headers={'Authorization': f'Bearer {token}'}
+        ) as response:
+            if response.status not in RETRYABLE_STATUSES or attempt == MAX_RETRIES:
+                response.raise_for_status()
+                return await response.json()
+        # Sleep outside the semaphore so other fetches keep going
+        await asyncio.sleep(_backoff_delay(attempt))
+
+@functools.lru_cache(maxsize=4)
+def _compute_filter(days_back: int, today: date) -> str:
+    """Build the Gmail search query for emails in the last days_back days."""
+    return f"after:{(today - timedelta(days=days_back)).strftime('%Y/%m/%d')}"
+
+def _dumps_line(obj: Dict[str, Any]) -> bytes:
+    """Serialize one record as a single NDJSON line."""
+    if orjson is not None:
+        return orjson.dumps(obj) + b'\n'
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n'
+
 class GmailWorkflow:
     """Comprehensive Gmail API workflow for email retrieval and processing."""
     
+    # Authenticated (credentials, service) pairs keyed by token file, shared across instances
+    _service_cache: Dict[str, Tuple[Any, Any]] = {}
+    
     def __init__(self):
         """Initialize the Gmail workflow with configurable settings."""
         # Configuration from environment variables with defaults
         self.credentials_file = os.getenv('CREDENTIALS_FILE', 'credentials.json')
-        self.token_file = os.getenv('TOKEN_FILE', 'token.pickle')
+        self.token_file = os.getenv('TOKEN_FILE', 'token.json')
         self.encryption_key_file = os.getenv('ENCRYPTION_KEY_FILE', 'encryption.key')
         
         # Gmail API scopes - using readonly for safety, can be extended
@@ -54,13 +131,40 @@ class GmailWorkflow:
         # Email retrieval settings
         self.days_back = int(os.getenv('DAYS_BACK', '30'))
         self.max_results = int(os.getenv('MAX_RESULTS', '100'))
-        self.output_file = os.getenv('OUTPUT_FILE', 'retrieved_emails.json')
+        # 'json' (default) or 'parquet' for columnar exports of large mailboxes
+        self.output_format = os.getenv('OUTPUT_FORMAT', 'json').lower()
+        if self.output_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+            # Decided up front so a long fetch is never lost at save time
+            logger.warning("OUTPUT_FORMAT=parquet requires pyarrow ('pip install pyarrow'); saving JSON instead")
+            self.output_format = 'json'
+        self.output_file = os.getenv('OUTPUT_FILE', f"retrieved_emails.{self.output_format}")
+        # Write one JSON record per line instead of a single indented document
+        self.stream_output = os.getenv('STREAM_OUTPUT', 'false').lower() == 'true'
+        # Output is written here first and then renamed, so a crash never leaves a partial file
+        self._tmp_output_file = self.output_file + '.tmp'
+        # Skip emails already saved in output_file and append the new ones to it
+        self.resume = os.getenv('RESUME', 'false').lower() == 'true'
+        self._previous_emails = []
+        # Set when resuming finds every listed email already saved
+        self._up_to_date = False
         
         # Authentication settings
         self.auth_port = int(os.getenv('AUTH_PORT', '8090'))
         self.include_body = os.getenv('INCLUDE_BODY', 'true').lower() == 'true'
+        # Cap on decoded body bytes per email; 0 means unlimited
+        self.body_max_bytes = int(os.getenv('BODY_MAX_BYTES', '0'))
+        
+        # Fetch settings: 'batch' groups gets into batch requests, 'async' and 'threads' fetch concurrently
+        self.fetch_mode = os.getenv('FETCH_MODE', 'batch').lower()
+        self.batch_size = max(1, min(int(os.getenv('GMAIL_BATCH_SIZE', str(BATCH_SIZE))), BATCH_SIZE))
+        self.message_fields = MESSAGE_FIELDS + (BODY_FIELDS if self.include_body else '')
         
         self.service = None
+        self.creds = None
+        self._retrieved = []
+        self._local = threading.local()
+        self._progress_lock = threading.Lock()
+        self._progress = 0
         
         logger.info(f"Gmail Workflow initialized with {self.days_back} days back, max {self.max_results} results")
         logger.info(f"Authentication port: {self.auth_port}, Include body: {self.include_body}")
@@ -80,14 +184,22 @@ class GmailWorkflow:
     
     def authenticate(self) -> bool:
         """Authenticate with Gmail API using OAuth2 with multiple fallback methods."""
+        from google.auth.transport.requests import Request
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        
         try:
+            cached = self._service_cache.get(self.token_file)
+            if cached and cached[0].valid:
+                self.creds, self.service = cached
+                logger.info("Reusing cached Gmail service")
+                return True
+            
             creds = None
             
             # Load existing token if available
-            if os.path.exists(self.token_file):
+            if os.path.exists(self.token_file) or os.path.exists(LEGACY_TOKEN_FILE):
                 try:
-                    with open(self.token_file, 'rb') as token:
-                        creds = pickle.load(token)
+                    creds = self._load_token()
                     logger.info("Loaded existing credentials from token file")
                 except Exception as e:
                     logger.warning(f"Error loading existing token: {str(e)}")
@@ -114,18 +226,15 @@ class GmailWorkflow:
                     
                     if creds:
                         # Save credentials for next run
-                        try:
-                            with open(self.token_file, 'wb') as token:
-                                pickle.dump(creds, token)
-                            logger.info("Saved credentials for future use")
-                        except Exception as e:
-                            logger.error(f"Failed to save credentials: {str(e)}")
+                        self._save_token(creds)
                     else:
                         logger.error("All authentication methods failed")
                         return False
             
             # Build the Gmail service
-            self.service = build('gmail', 'v1', credentials=creds)
+            self.creds = creds
+            self.service = self._build_service(creds)
+            self._service_cache[self.token_file] = (creds, self.service)
             logger.info("Successfully authenticated with Gmail API")
             return True
             
@@ -133,6 +242,42 @@ class GmailWorkflow:
             logger.error(f"Authentication failed: {str(e)}")
             return False
     
+    @staticmethod
+    def _build_service(creds: Any) -> Any:
+        """Build the Gmail service from the discovery document bundled with the client library."""
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build
+        
+        # One keep-alive transport per service, so every call after the first reuses its TLS connection
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        return build('gmail', 'v1', http=http, static_discovery=True, cache_discovery=False)
+    
+    def _load_token(self) -> Any:
+        """Load saved credentials, accepting JSON or a token pickled by older versions."""
+        from google.oauth2.credentials import Credentials
+        
+        path = self.token_file if os.path.exists(self.token_file) else LEGACY_TOKEN_FILE
+        with open(path, 'rb', buffering=io.DEFAULT_BUFFER_SIZE) as token:
+            data = token.read()
+        
+        # Pickles written with protocol 2 or later start with the PROTO opcode
+        if data[:1] == b'\x80':
+            creds = pickle.loads(data)
+            logger.info(f"Migrating pickled token {path} to JSON {self.token_file}")
+            self._save_token(creds)
+            return creds
+        return Credentials.from_authorized_user_info(json.loads(data), scopes=self.scopes)
+    
+    def _save_token(self, creds: Any) -> None:
+        """Write credentials to the token file as JSON."""
+        try:
+            with open(self.token_file, 'w', encoding='utf-8') as token:
+                token.write(creds.to_json())
+            logger.info("Saved credentials for future use")
+        except Exception as e:
+            logger.error(f"Failed to save credentials: {str(e)}")
+    
     def _try_authentication_methods(self, flow) -> Optional[Any]:
         """Try multiple authentication methods with fallbacks."""
         methods = [
@@ -166,17 +311,16 @@ class GmailWorkflow:
     
     def get_email_filter(self) -> str:
         """Create Gmail API filter for recent emails."""
-        date_after = datetime.now() - timedelta(days=self.days_back)
-        date_str = date_after.strftime('%Y/%m/%d')
-        
-        # Create filter query
-        filter_query = f"after:{date_str}"
+        # The query only changes once per day, so it is memoized on today's date
+        filter_query = _compute_filter(self.days_back, date.today())
         logger.info(f"Using filter: {filter_query}")
         
         return filter_query
     
     def retrieve_emails(self) -> List[Dict[str, Any]]:
         """Retrieve emails from Gmail API with comprehensive error handling."""
+        from googleapiclient.errors import HttpError
+        
         if not self.service:
             logger.error("Gmail service not initialized. Please authenticate first.")
             return []
@@ -186,50 +330,36 @@ class GmailWorkflow:
             
             # Get list of email IDs
             logger.info("Retrieving email list...")
-            results = self.service.users().messages().list(
-                userId='me',
-                q=filter_query,
-                maxResults=self.max_results
-            ).execute()
-            
-            messages = results.get('messages', [])
+            messages = self._list_all_ids(filter_query)
             logger.info(f"Found {len(messages)} emails to retrieve")
             
+            if self.resume and messages:
+                previous = self._load_already_fetched()
+                if previous is None:
+                    # Saving now would replace the unreadable history with only the new emails
+                    logger.error(f"Refusing to resume from {self.output_file}; move it aside or unset RESUME")
+                    return []
+                # Emails that failed extraction are fetched again
+                self._previous_emails = [email for email in previous if not email.get('error')]
+                seen_ids = {email.get('id') for email in self._previous_emails}
+                messages = [message for message in messages if message['id'] not in seen_ids]
+                logger.info(f"Skipping {len(seen_ids)} already retrieved emails, {len(messages)} new")
+                if not messages:
+                    logger.info(f"No new emails since the last run; {self.output_file} is up to date")
+                    self._up_to_date = True
+                    return []
+            
             if not messages:
                 logger.warning("No emails found matching the criteria")
                 return []
             
-            # Retrieve full email details
-            emails = []
-            for i, message in enumerate(messages):
-                logger.info(f"Retrieving email {i+1}/{len(messages)}: {message['id']}")
-                
-                try:
-                    # Choose format based on settings
-                    if self.include_body:
-                        email_data = self.service.users().messages().get(
-                            userId='me',
-                            id=message['id'],
-                            format='full'
-                        ).execute()
-                    else:
-                        email_data = self.service.users().messages().get(
-                            userId='me',
-                            id=message['id'],
-                            format='metadata',
-                            metadataHeaders=['Subject', 'From', 'To', 'Date']
-                        ).execute()
-                    
-                    # Extract relevant email information
-                    email_info = self.extract_email_info(email_data)
-                    emails.append(email_info)
-                    
-                except HttpError as e:
-                    logger.error(f"Error retrieving email {message['id']}: {str(e)}")
-                    continue
-                except Exception as e:
-                    logger.error(f"Unexpected error retrieving email {message['id']}: {str(e)}")
-                    continue
+            # aiohttp is optional: without it FETCH_MODE=async falls back to batch requests
+            if self.fetch_mode == 'async' and importlib.util.find_spec('aiohttp') is not None:
+                emails = self._retrieve_async([message['id'] for message in messages])
+            elif self.fetch_mode == 'threads':
+                emails = self._retrieve_threaded([message['id'] for message in messages])
+            else:
+                emails = self._retrieve_batched(messages)
             
             logger.info(f"Successfully retrieved {len(emails)} emails")
             return emails
@@ -241,17 +371,152 @@ class GmailWorkflow:
             logger.error(f"Unexpected error during email retrieval: {str(e)}")
             return []
     
+    def _list_all_ids(self, query: str) -> List[Dict[str, Any]]:
+        """List up to max_results message ids, following nextPageToken across pages."""
+        messages = []
+        page_token = None
+        while len(messages) < self.max_results:
+            response = _execute_with_backoff(self.service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=min(LIST_PAGE_SIZE, self.max_results - len(messages)),
+                pageToken=page_token,
+                fields=LIST_FIELDS
+            ))
+            messages.extend(response.get('messages', []))
+            
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        
+        return messages[:self.max_results]
+    
+    def _retrieve_batched(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Retrieve emails up to batch_size messages per HTTP request."""
+        self._retrieved = []
+        for start in range(0, len(messages), self.batch_size):
+            chunk = messages[start:start + self.batch_size]
+            logger.info(f"Retrieving emails {start+1}-{start+len(chunk)}/{len(messages)} in one batch")
+            
+            batch = self.service.new_batch_http_request(callback=self._on_message)
+            for message in chunk:
+                batch.add(self._message_request(message['id']), request_id=message['id'])
+            batch.execute()
+        
+        emails = self._retrieved
+        self._retrieved = []
+        return emails
+    
+    def _retrieve_async(self, msg_ids: List[str]) -> List[Dict[str, Any]]:
+        """Retrieve emails concurrently over the Gmail REST API."""
+        from google.auth.transport.requests import Request
+        
+        # Refresh once up front so concurrent fetches never race on an expiring token
+        if self.creds.expired and self.creds.refresh_token:
+            self.creds.refresh(Request())
+        
+        logger.info(f"Retrieving {len(msg_ids)} emails with up to {MAX_CONCURRENT_FETCHES} concurrent requests")
+        return asyncio.run(self._fetch_all(msg_ids))
+    
+    async def _fetch_all(self, msg_ids: List[str]) -> List[Dict[str, Any]]:
+        """Fetch all messages over one pooled aiohttp session."""
+        import aiohttp
+        
+        if self.include_body:
+            params = [('format', 'full')]
+        else:
+            params = [('format', 'metadata')] + [('metadataHeaders', header) for header in METADATA_HEADERS]
+        params.append(('fields', self.message_fields))
+        
+        sem = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+        connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_FETCHES)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            results = await asyncio.gather(
+                *[_fetch_one(session, sem, msg_id, self.creds.token, params) for msg_id in msg_ids],
+                return_exceptions=True
+            )
+        
+        emails = []
+        for msg_id, result in zip(msg_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error retrieving email {msg_id}: {str(result)}")
+                continue
+            emails.append(self.extract_email_info(result))
+        return emails
+    
+    def _retrieve_threaded(self, msg_ids: List[str]) -> List[Dict[str, Any]]:
+        """Retrieve emails on a thread pool, one blocking get per message."""
+        self._progress = 0
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FETCHES) as pool:
+            results = list(pool.map(lambda msg_id: self._fetch_threaded(msg_id, len(msg_ids)), msg_ids))
+        return [email for email in results if email is not None]
+    
+    def _fetch_threaded(self, msg_id: str, total: int) -> Optional[Dict[str, Any]]:
+        """Fetch one email on a worker thread using that thread's own service."""
+        from googleapiclient.errors import HttpError
+        
+        with self._progress_lock:
+            self._progress += 1
+            logger.info(f"Retrieving email {self._progress}/{total}: {msg_id}")
+        
+        # httplib2.Http is not thread-safe, so each worker builds its own service
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = self._local.service = self._build_service(self.creds)
+        
+        try:
+            return self.extract_email_info(_execute_with_backoff(self._message_request(msg_id, service)))
+        except HttpError as e:
+            logger.error(f"Error retrieving email {msg_id}: {str(e)}")
+        except Exception as e:
+            logger.error(f"Unexpected error retrieving email {msg_id}: {str(e)}")
+        return None
+    
+    def _message_request(self, msg_id: str, service: Optional[Any] = None) -> Any:
+        """Build the messages.get request for one email in the configured format."""
+        messages = (service or self.service).users().messages()
+        if self.include_body:
+            return messages.get(
+                userId='me',
+                id=msg_id,
+                format='full',
+                fields=self.message_fields
+            )
+        return messages.get(
+            userId='me',
+            id=msg_id,
+            format='metadata',
+            metadataHeaders=METADATA_HEADERS,
+            fields=self.message_fields
+        )
+    
+    def _on_message(self, request_id: str, response: Dict[str, Any], exception: Optional[Exception]) -> None:
+        """Batch callback: collect one email, logging failures without aborting the batch."""
+        if exception is not None:
+            status = getattr(getattr(exception, 'resp', None), 'status', None)
+            if status not in RETRYABLE_STATUSES:
+                logger.error(f"Error retrieving email {request_id}: {str(exception)}")
+                return
+            
+            # Rate limited or transient server error: retry this message on its own
+            try:
+                response = _execute_with_backoff(self._message_request(request_id))
+            except Exception as e:
+                logger.error(f"Error retrieving email {request_id}: {str(e)}")
+                return
+        
+        self._retrieved.append(self.extract_email_info(response))
+    
     def extract_email_info(self, email_data: Dict[str, Any]) -> Dict[str, Any]:
         """Extract relevant information from Gmail API email data."""
         try:
             # Extract headers
-            headers = email_data.get('payload', {}).get('headers', [])
-            header_dict = {header['name']: header['value'] for header in headers}
-            
-            # Extract body content if requested
-            body = ""
-            if self.include_body:
-                body = self.extract_email_body(email_data.get('payload', {}))
+            payload = email_data.get('payload', {})
+            headers = payload.get('headers', [])
+            header_dict = {
+                header['name'].lower(): header['value']
+                for header in headers if header['name'].lower() in _WANTED_HEADERS
+            }
             
             # Extract labels
             labels = email_data.get('labelIds', [])
@@ -260,19 +525,19 @@ class GmailWorkflow:
             email_info = {
                 'id': email_data.get('id'),
                 'threadId': email_data.get('threadId'),
-                'subject': header_dict.get('Subject', 'No Subject'),
-                'sender': header_dict.get('From', 'Unknown'),
-                'recipient': header_dict.get('To', 'Unknown'),
-                'date': header_dict.get('Date', 'Unknown'),
+                'subject': header_dict.get('subject', 'No Subject'),
+                'sender': header_dict.get('from', 'Unknown'),
+                'recipient': header_dict.get('to', 'Unknown'),
+                'date': header_dict.get('date', 'Unknown'),
                 'labels': labels,
                 'snippet': email_data.get('snippet', ''),
                 'internalDate': email_data.get('internalDate'),
                 'sizeEstimate': email_data.get('sizeEstimate')
             }
             
-            # Add body if included
+            # Metadata responses carry no body parts, so only walk the payload when bodies were requested
             if self.include_body:
-                email_info['body'] = body
+                email_info['body'] = self.extract_email_body(payload)
             
             return email_info
             
@@ -286,28 +551,46 @@ class GmailWorkflow:
     def extract_email_body(self, payload: Dict[str, Any]) -> str:
         """Extract email body content from Gmail API payload."""
         try:
-            # Handle multipart messages
-            if 'parts' in payload:
-                body = ""
-                for part in payload['parts']:
-                    if part.get('mimeType') == 'text/plain':
-                        body_data = part.get('body', {}).get('data', '')
-                        if body_data:
-                            body += base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
-                return body
+            parts = []
+            remaining = self.body_max_bytes
             
-            # Handle simple text messages
-            elif payload.get('mimeType') == 'text/plain':
-                body_data = payload.get('body', {}).get('data', '')
-                if body_data:
-                    return base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
+            # Walk nested multipart/alternative and multipart/mixed parts in document order
+            stack = [payload]
+            while stack:
+                part = stack.pop()
+                if 'parts' in part:
+                    stack.extend(reversed(part['parts']))
+                    continue
+                
+                body_data = part.get('body', {}).get('data', '') if part.get('mimeType') == 'text/plain' else ''
+                if not body_data:
+                    continue
+                
+                text, size = self._decode_body_data(body_data, remaining)
+                parts.append(text)
+                if self.body_max_bytes:
+                    remaining -= size
+                    if remaining <= 0:
+                        break
             
-            return "Email body not available"
+            return ''.join(parts) if parts else "Email body not available"
             
         except Exception as e:
             logger.error(f"Error extracting email body: {str(e)}")
             return "Error extracting email body"
     
+    @staticmethod
+    def _decode_body_data(data: str, limit: int) -> Tuple[str, int]:
+        """Decode base64url body data to (text, bytes used), keeping at most limit bytes when set."""
+        if limit > 0:
+            # Every 4 base64 characters encode 3 bytes
+            data = data[:(limit + 2) // 3 * 4]
+        raw = base64.urlsafe_b64decode(data)
+        if limit > 0:
+            # Cut on bytes; a multi-byte character split at the cut is dropped by errors='ignore'
+            raw = raw[:limit]
+        return raw.decode('utf-8', errors='ignore'), len(raw)
+    
     def save_emails(self, emails: List[Dict[str, Any]]) -> None:
         """Save retrieved emails to JSON file with comprehensive metadata."""
         try:
@@ -321,14 +604,58 @@ class GmailWorkflow:
                 'emails': emails
             }
             
-            with open(self.output_file, 'w', encoding='utf-8') as f:
-                json.dump(output_data, f, indent=2, ensure_ascii=False)
+            if self.output_format == 'parquet':
+                self._save_parquet(emails)
+            elif self.stream_output:
+                # NDJSON: a metadata line, then one line per email
+                del output_data['emails']
+                with open(self._tmp_output_file, 'wb', buffering=OUTPUT_BUFFER_SIZE) as f:
+                    f.write(_dumps_line(output_data))
+                    for email in emails:
+                        f.write(_dumps_line(email))
+            elif orjson is not None:
+                with open(self._tmp_output_file, 'wb', buffering=OUTPUT_BUFFER_SIZE) as f:
+                    f.write(orjson.dumps(output_data, option=orjson.OPT_INDENT_2))
+            else:
+                with open(self._tmp_output_file, 'w', encoding='utf-8') as f:
+                    json.dump(output_data, f, indent=2, ensure_ascii=False)
             
+            os.replace(self._tmp_output_file, self.output_file)
             logger.info(f"Saved {len(emails)} emails to {self.output_file}")
             
         except Exception as e:
             logger.error(f"Error saving emails: {str(e)}")
     
+    def _save_parquet(self, emails: List[Dict[str, Any]]) -> None:
+        """Write retrieved emails as a zstd-compressed Parquet table, one column per field."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        columns = list(EMAIL_COLUMNS) + (['body'] if self.include_body else [])
+        table = pa.Table.from_pydict({column: [email.get(column) for email in emails] for column in columns})
+        pq.write_table(table, self._tmp_output_file, compression='zstd')
+    
+    def _load_already_fetched(self) -> Optional[List[Dict[str, Any]]]:
+        """Load the emails saved by a previous run of this output file, or None if it cannot be read."""
+        if not os.path.exists(self.output_file):
+            return []
+        
+        try:
+            if self.output_format == 'parquet':
+                import pyarrow.parquet as pq
+                return pq.read_table(self.output_file).to_pylist()
+            
+            loads = orjson.loads if orjson is not None else json.loads
+            with open(self.output_file, 'rb', buffering=OUTPUT_BUFFER_SIZE) as f:
+                if self.stream_output:
+                    # Skip the NDJSON metadata line
+                    next(f, None)
+                    return [loads(line) for line in f if line.strip()]
+                return loads(f.read()).get('emails', [])
+        except Exception as e:
+            logger.error(f"Could not read previously retrieved emails from {self.output_file}: {str(e)}")
+            return None
+    
     def print_summary(self, emails: List[Dict[str, Any]]) -> None:
         """Print a comprehensive summary of retrieved emails."""
         print("\n" + "="*60)
@@ -368,11 +695,14 @@ class GmailWorkflow:
             # Step 2: Retrieve emails
             emails = self.retrieve_emails()
             
-            # Step 3: Save emails
+            # Step 3: Save emails, keeping those from previous runs when resuming
             if emails:
-                self.save_emails(emails)
+                self.save_emails(self._previous_emails + emails)
                 self.print_summary(emails)
                 return True
+            elif self._up_to_date:
+                # Nothing new to add; the saved file is left as it is
+                return True
             else:
                 logger.warning("No emails retrieved. Check your filter criteria.")
                 return False
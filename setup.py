@@ -48,6 +48,9 @@ setup(
         "aws": [
             "boto3>=1.34.0",
         ],
+        "parquet": [
+            "pyarrow>=14.0.1",
+        ],
     },
     entry_points={
         "console_scripts": [
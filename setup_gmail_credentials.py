@@ -4,124 +4,194 @@ Gmail Credentials Setup Script
 Configures Gmail API credentials with the provided client ID
 """
 
+import functools
 import json
 import os
 import sys
-from pathlib import Path
-from gmail_config_manager import GmailConfigManager
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from gmail_config_manager import GmailConfigManager
+
+try:
+    import orjson
+except ImportError:  # Optional: fall back to the stdlib encoder
+    orjson = None
+
+CREDENTIALS_FILE = "credentials.json"
+
+
+def _dumps_indented(obj: Any) -> str:
+    """Pretty-print JSON with two-space indentation"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2)
+
+
+def _present_files() -> Set[str]:
+    """Names in the current directory, from one scan instead of a stat() per file"""
+    return {entry.name for entry in os.scandir(".")}
+
+
+@functools.lru_cache(maxsize=1)
+def _get_config_manager() -> "GmailConfigManager":
+    """Return the config manager shared by every command in this process"""
+    # Imported on first use so importing this script has no config-module side effects
+    from gmail_config_manager import GmailConfigManager
+
+    return GmailConfigManager()
+
+
+def _load_credentials_once(path: str = CREDENTIALS_FILE) -> Tuple[Optional[bytes], Optional[Dict[str, Any]]]:
+    """Read credentials.json once, returning its bytes and parsed JSON (None for either if unavailable)"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None, None
+
+    try:
+        return data, orjson.loads(data) if orjson is not None else json.loads(data)
+    except ValueError:  # json.JSONDecodeError and orjson.JSONDecodeError
+        return data, None
+
+
+def _write_lines(lines: List[str]) -> None:
+    """Write collected output lines to stdout in one call instead of one print() each"""
+    sys.stdout.write("\n".join(lines) + "\n")
+
+
+def _report_existing_credentials(
+    config_manager: "GmailConfigManager", credentials: Optional[Dict[str, Any]], out: List[str]
+) -> bool:
+    """Append the found/validation lines for credentials.json and return whether it is valid"""
+    out.append(f"\n📄 Found existing credentials file: {CREDENTIALS_FILE}")
+
+    # Validate existing credentials
+    if credentials is not None and config_manager.validate_credentials(credentials=credentials):
+        out.append("✅ Existing credentials are valid")
+        return True
+    out.append("⚠️ Existing credentials need to be updated")
+    return False
 
 
 def setup_gmail_credentials():
     """Set up Gmail API credentials with the provided client ID"""
-    print("🔧 Setting up Gmail API Credentials")
-    print("=" * 50)
+    out = ["🔧 Setting up Gmail API Credentials", "=" * 50]
 
-    config_manager = GmailConfigManager()
+    config_manager = _get_config_manager()
+    scopes = config_manager.get_scopes()
+    uris = config_manager.get_redirect_uris()
 
     # Display current configuration
-    print(f"Client ID: {config_manager.get_client_id()}")
-    print(f"Scopes: {', '.join(config_manager.get_scopes())}")
-    print(f"Redirect URIs: {', '.join(config_manager.get_redirect_uris())}")
+    out.append(f"Client ID: {config_manager.get_client_id()}")
+    out.append(f"Scopes: {', '.join(scopes)}")
+    out.append(f"Redirect URIs: {', '.join(uris)}")
+
+    # Check existing credentials first; valid ones need no template or instructions
+    data, credentials = _load_credentials_once()
+    if data is not None and _report_existing_credentials(config_manager, credentials, out):
+        _write_lines(out)
+        return True
 
     # Create credentials template
-    print("\n📝 Creating credentials template...")
+    out.append("\n📝 Creating credentials template...")
     if config_manager.create_credentials_template():
-        print("✅ Credentials template created")
+        out.append("✅ Credentials template created")
     else:
-        print("❌ Failed to create credentials template")
+        out.append("❌ Failed to create credentials template")
+        _write_lines(out)
         return False
 
-    # Check if credentials.json exists
-    credentials_file = Path("credentials.json")
-    if credentials_file.exists():
-        print(f"\n📄 Found existing credentials file: {credentials_file}")
-
-        # Validate existing credentials
-        if config_manager.validate_credentials():
-            print("✅ Existing credentials are valid")
+    # The template step writes credentials.json when it was missing; report it as before
+    if data is None:
+        data, credentials = _load_credentials_once()
+        if data is not None and _report_existing_credentials(config_manager, credentials, out):
+            _write_lines(out)
             return True
-        else:
-            print("⚠️ Existing credentials need to be updated")
 
     # Provide setup instructions
-    print("\n📋 Setup Instructions:")
-    print("1. Go to Google Cloud Console: https://console.cloud.google.com/")
-    print("2. Create a new project or select existing one")
-    print("3. Enable Gmail API:")
-    print("   gcloud services enable gmail.googleapis.com")
-    print("4. Go to 'APIs & Services' > 'Credentials'")
-    print("5. Click 'Create Credentials' > 'OAuth 2.0 Client IDs'")
-    print("6. Configure OAuth consent screen:")
-    print("   - User Type: External")
-    print("   - App name: Gmail Information Tagging")
-    print("   - User support email: your-email@domain.com")
-    print("   - Developer contact information: your-email@domain.com")
-    print("7. Add these scopes:")
-    for scope in config_manager.get_scopes():
-        print(f"   - {scope}")
-    print("8. Add these redirect URIs:")
-    for uri in config_manager.get_redirect_uris():
-        print(f"   - {uri}")
-    print("9. Download the credentials JSON file")
-    print("10. Replace the existing credentials.json with the downloaded file")
-
-    print("\n🔗 OAuth2 Authorization URL:")
-    print(config_manager.get_oauth_url())
-
-    print("\n📄 Current credentials.json template:")
-    try:
-        with open("credentials.json", "r") as f:
-            template = json.load(f)
-        print(json.dumps(template, indent=2))
-    except Exception as e:
-        print(f"Error reading credentials template: {e}")
-
-    print("\n" + "=" * 50)
-    print("✅ Gmail credentials setup complete!")
-    print("Next steps:")
-    print("1. Download credentials from Google Cloud Console")
-    print("2. Replace credentials.json with the downloaded file")
-    print("3. Run: python main.py")
+    out.append("\n📋 Setup Instructions:")
+    out.append("1. Go to Google Cloud Console: https://console.cloud.google.com/")
+    out.append("2. Create a new project or select existing one")
+    out.append("3. Enable Gmail API:")
+    out.append("   gcloud services enable gmail.googleapis.com")
+    out.append("4. Go to 'APIs & Services' > 'Credentials'")
+    out.append("5. Click 'Create Credentials' > 'OAuth 2.0 Client IDs'")
+    out.append("6. Configure OAuth consent screen:")
+    out.append("   - User Type: External")
+    out.append("   - App name: Gmail Information Tagging")
+    out.append("   - User support email: your-email@domain.com")
+    out.append("   - Developer contact information: your-email@domain.com")
+    out.append("7. Add these scopes:")
+    out.extend(f"   - {scope}" for scope in scopes)
+    out.append("8. Add these redirect URIs:")
+    out.extend(f"   - {uri}" for uri in uris)
+    out.append("9. Download the credentials JSON file")
+    out.append("10. Replace the existing credentials.json with the downloaded file")
+
+    out.append("\n🔗 OAuth2 Authorization URL:")
+    out.append(config_manager.get_oauth_url())
+
+    out.append("\n📄 Current credentials.json template:")
+    if credentials is not None:
+        out.append(_dumps_indented(credentials))
+    else:
+        out.append("Error reading credentials template: credentials.json is missing or not valid JSON")
+
+    out.append("\n" + "=" * 50)
+    out.append("✅ Gmail credentials setup complete!")
+    out.append("Next steps:")
+    out.append("1. Download credentials from Google Cloud Console")
+    out.append("2. Replace credentials.json with the downloaded file")
+    out.append("3. Run: python main.py")
+
+    _write_lines(out)
 
     return True
 
 
 def validate_setup():
     """Validate the complete setup"""
-    print("\n🔍 Validating Setup...")
+    out = ["\n🔍 Validating Setup..."]
+
+    config_manager = _get_config_manager()
 
-    config_manager = GmailConfigManager()
+    present = _present_files()
 
     # Check required files
-    required_files = ["credentials.json", "encryption.key", ".env"]
+    required_files = [CREDENTIALS_FILE, "encryption.key", ".env"]
 
     for file_path in required_files:
-        if os.path.exists(file_path):
-            print(f"✅ {file_path} exists")
+        if file_path in present:
+            out.append(f"✅ {file_path} exists")
         else:
-            print(f"❌ {file_path} missing")
+            out.append(f"❌ {file_path} missing")
 
     # Validate credentials
     if config_manager.validate_credentials():
-        print("✅ Gmail credentials are valid")
+        out.append("✅ Gmail credentials are valid")
     else:
-        print("❌ Gmail credentials need configuration")
+        out.append("❌ Gmail credentials need configuration")
 
     # Check virtual environment
-    if os.path.exists("gmail_env"):
-        print("✅ Virtual environment exists")
+    if "gmail_env" in present:
+        out.append("✅ Virtual environment exists")
     else:
-        print("❌ Virtual environment missing")
+        out.append("❌ Virtual environment missing")
 
-    print("\n🎯 Setup validation complete!")
+    out.append("\n🎯 Setup validation complete!")
+    _write_lines(out)
+
+
+_COMMANDS = {"validate": validate_setup, "setup": setup_gmail_credentials}
 
 
 def main():
     """Main function"""
-    if len(sys.argv) > 1 and sys.argv[1] == "validate":
-        validate_setup()
-    else:
-        setup_gmail_credentials()
+    # Anything other than a known command runs setup, as before
+    command = sys.argv[1] if len(sys.argv) > 1 else "setup"
+    _COMMANDS.get(command, setup_gmail_credentials)()
 
 
 if __name__ == "__main__":